@@ -2,16 +2,19 @@
 
 import os
 import ccxt
-import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view as swv
 import asyncio
-import json
-from datetime import datetime, timedelta
+import orjson
+from datetime import datetime
+from numba import njit
 from apscheduler.schedulers.background import BackgroundScheduler
 from telegram import Bot
 from flask import Flask, jsonify, render_template_string
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import time
+from types import SimpleNamespace
 import traceback 
 
 # --- CONFIGURATION ---
@@ -25,13 +28,18 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
 # Assets to monitor
-CRYPTOS = [s.strip() for s in os.getenv("CRYPTOS", "BTC/USDT,ETH/USDT,SOL/USDT").split(',')]
+CRYPTOS = tuple(s.strip() for s in os.getenv("CRYPTOS", "BTC/USDT,ETH/USDT,SOL/USDT").split(','))
 TIMEFRAME_MAIN = "4h"  # Major Trend
 TIMEFRAME_ENTRY = "1h" # Entry Precision
 
 # Initialize Bot and Exchange
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
 exchange = ccxt.kraken({'enableRateLimit': True, 'rateLimit': 2000})
+MARKET_IDS = {}  # symbol -> exchange market id, filled in start_bot
+
+# Long-lived event loop for Telegram so the bot's HTTP pool is reused
+_tg_loop = asyncio.new_event_loop()
+threading.Thread(target=_tg_loop.run_forever, daemon=True).start()
 
 # Global Stats & History
 bot_stats = {
@@ -43,8 +51,23 @@ bot_stats = {
     "version": "V2.6 Premium Quant (2HR Cycle)"
 }
 
+# In-memory OHLCV cache: (market_id, timeframe, limit) -> (fetched_at, ohlcv)
+_OHLCV_CACHE = {}
+_TF_SECONDS = {"1h": 3600, "4h": 14400, "1d": 86400}
+# Only the daily candles are reused across jobs (the previous day is final);
+# intraday bars must stay fresh for the 15-minute trade checker
+_TTL = {"1d": 43200}
+
+stats_lock = threading.Lock()
+# ccxt's sync throttle isn't thread-safe; serialize calls on the shared exchange
+exchange_lock = threading.Lock()
+
+# Running dashboard counters (guarded by stats_lock)
+STATS = {"total": 0, "wins": 0, "losses": 0}
+
 trade_history = []
-TRADE_FILE = "crypto_trade_history.json"
+TRADE_FILE = "crypto_trade_history.jsonl"  # append-only, one trade record per line
+LEGACY_TRADE_FILE = "crypto_trade_history.json"  # pre-JSONL array format
 
 # =========================================================================
 # === DATA PERSISTENCE ===
@@ -53,55 +76,161 @@ TRADE_FILE = "crypto_trade_history.json"
 def load_history():
     global trade_history
     try:
+        if not os.path.exists(TRADE_FILE) and os.path.exists(LEGACY_TRADE_FILE):
+            # One-time migration from the old JSON array file
+            with open(LEGACY_TRADE_FILE, 'rb') as f:
+                legacy = orjson.loads(f.read())
+            # Older versions could write duplicate ids; renumber repeats so none collapse
+            next_id = max((t['id'] for t in legacy), default=0) + 1
+            seen = set()
+            for t in legacy:
+                if t['id'] in seen:
+                    t['id'] = next_id
+                    next_id += 1
+                seen.add(t['id'])
+            trade_history = legacy
+            compact_history()
         if os.path.exists(TRADE_FILE):
-            with open(TRADE_FILE, 'r') as f:
-                trade_history = json.load(f)
-                print(f"📊 Loaded {len(trade_history)} trades")
+            # Later lines supersede earlier ones for the same trade id
+            latest = {}
+            with open(TRADE_FILE, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        t = orjson.loads(line)
+                        latest[t['id']] = t
+            trade_history = list(latest.values())
+            with stats_lock:
+                STATS['total'] = len(trade_history)
+                STATS['wins'] = sum(1 for t in trade_history if t.get('outcome') == 'WIN')
+                STATS['losses'] = sum(1 for t in trade_history if t.get('outcome') == 'LOSS')
+            print(f"📊 Loaded {len(trade_history)} trades")
     except Exception as e:
         print(f"⚠️ Load history failed: {e}")
 
-def save_history():
+def save_history(trades):
+    """Append new or updated trades to the history log."""
     try:
-        with open(TRADE_FILE, 'w') as f:
-            json.dump(trade_history, f, indent=2)
+        with open(TRADE_FILE, 'ab') as f:
+            f.write(b''.join(orjson.dumps(t) + b'\n' for t in trades))
     except Exception as e:
         print(f"⚠️ Save history failed: {e}")
 
+def compact_history():
+    """Rewrite the log with only the latest record per trade."""
+    try:
+        tmp = TRADE_FILE + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(orjson.dumps(t) + b'\n' for t in trade_history))
+        os.replace(tmp, TRADE_FILE)
+    except Exception as e:
+        print(f"⚠️ Compact history failed: {e}")
+
 # =========================================================================
 # === HELPER FUNCTIONS ===
 # =========================================================================
 
-def calculate_cpr_levels(df_daily):
-    """Calculates Daily Pivot Points."""
-    if df_daily.empty or len(df_daily) < 2: return None
-    prev_day = df_daily.iloc[-2]
-    H, L, C = prev_day['high'], prev_day['low'], prev_day['close']
+def send_messages(messages):
+    """Send a batch of HTML messages concurrently on the shared Telegram loop."""
+    if not messages: return
+    async def _send_all():
+        return await asyncio.gather(
+            *[bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=m, parse_mode='HTML') for m in messages],
+            return_exceptions=True)
+    results = asyncio.run_coroutine_threadsafe(_send_all(), _tg_loop).result()
+    for r in results:
+        if isinstance(r, Exception): print(f"⚠️ Telegram send failed: {r}")
+
+@njit(cache=True, fastmath=True)
+def _cpr_kernel(H, L, C):
+    """Pivot kernel: returns (PP, TC, BC, R1, S1, R2, S2)."""
     PP = (H + L + C) / 3.0
     BC = (H + L) / 2.0
     TC = PP - BC + PP
+    return PP, TC, BC, 2*PP - L, 2*PP - H, PP + (H - L), PP - (H - L)
+
+def calculate_cpr_levels(H, L, C):
+    """Calculates Daily Pivot Points from the previous day's high/low/close."""
+    PP, TC, BC, R1, S1, R2, S2 = _cpr_kernel(H, L, C)
     return {
         'PP': PP, 'TC': TC, 'BC': BC,
-        'R1': 2*PP - L, 'S1': 2*PP - H,
-        'R2': PP + (H - L), 'S2': PP - (H - L)
+        'R1': R1, 'S1': S1,
+        'R2': R2, 'S2': S2
     }
 
-def fetch_data_safe(symbol, timeframe):
+@njit(cache=True)
+def eval_trades(price, entry, tp1, tp2, sl, is_buy, out_status):
+    """Writes status codes (0=none, 1=TP1, 2=TP2, 3=SL) into out_status."""
+    for i in range(entry.shape[0]):
+        if is_buy[i]:
+            if price >= tp2[i]: out_status[i] = 2
+            elif price >= tp1[i]: out_status[i] = 1
+            elif price <= sl[i]: out_status[i] = 3
+            else: out_status[i] = 0
+        else:
+            if price <= tp2[i]: out_status[i] = 2
+            elif price <= tp1[i]: out_status[i] = 1
+            elif price >= sl[i]: out_status[i] = 3
+            else: out_status[i] = 0
+
+def init_markets():
+    """Load exchange markets once and cache the ids of monitored assets."""
+    try:
+        with exchange_lock: exchange.load_markets()
+    except Exception as e:
+        print(f"⚠️ Load markets failed: {e}")
+        return
+    for s in CRYPTOS:
+        try:
+            MARKET_IDS[s] = exchange.market(s)['id']
+        except Exception as e:
+            print(f"⚠️ Unknown market {s}: {e}")
+
+def get_market_id(symbol):
+    """Cached market id; also covers symbols outside CRYPTOS and a failed startup load."""
+    if symbol not in MARKET_IDS:
+        if not exchange.markets: init_markets()
+        MARKET_IDS[symbol] = exchange.market(symbol)['id']
+    return MARKET_IDS[symbol]
+
+def sma(close, n):
+    """Simple moving average over strided windows, NaN-padded to len(close)."""
+    if len(close) < n: return np.full(len(close), np.nan)
+    return np.concatenate([np.full(n - 1, np.nan), swv(close, n).mean(axis=-1)])
+
+def fetch_ohlcv_cached(market_id, timeframe, limit):
+    """OHLCV as a float ndarray; cached per _TTL, never across a candle boundary."""
+    ttl = _TTL.get(timeframe, 0)
+    key = (market_id, timeframe, limit)
+    period = _TF_SECONDS[timeframe]
+    now = time.time()
+    cached = _OHLCV_CACHE.get(key)
+    if cached and now - cached[0] < ttl and now // period == cached[0] // period:
+        return cached[1]
+    with exchange_lock:
+        ohlcv = exchange.fetch_ohlcv(market_id, timeframe, limit=limit)
+    ohlcv = np.asarray(ohlcv, dtype=np.float64)
+    if ttl: _OHLCV_CACHE[key] = (now, ohlcv)
+    return ohlcv
+
+def fetch_data_safe(symbol, timeframe, limit=30):
     """Robust fetcher with retries."""
+    try:
+        market_id = get_market_id(symbol)
+    except Exception as e:
+        print(f"⚠️ Unknown market {symbol}: {e}")
+        return None
+
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            if not exchange.markets: exchange.load_markets()
-            market_id = exchange.market(symbol)['id']
-            ohlcv = exchange.fetch_ohlcv(market_id, timeframe, limit=100)
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df.set_index('timestamp', inplace=True)
-            df['sma9'] = df['close'].rolling(9).mean()
-            df['sma20'] = df['close'].rolling(20).mean()
-            return df.dropna()
+            ohlcv = fetch_ohlcv_cached(market_id, timeframe, limit)
+            if len(ohlcv) < 20: return None  # not enough bars for SMA20
+            close = ohlcv[:, 4]
+            # Leading SMA values are NaN; callers only read the last bar
+            return SimpleNamespace(close=close, sma9=sma(close, 9), sma20=sma(close, 20))
         except:
             time.sleep(2)
-    return pd.DataFrame()
+    return None
 
 # =========================================================================
 # === TRADING & TRACKING LOGIC ===
@@ -111,7 +240,6 @@ def record_trade(symbol, signal, entry, tp1, tp2, sl):
     """Save trade to history."""
     try:
         t = {
-            "id": len(trade_history) + 1,
             "symbol": symbol,
             "signal": signal,
             "entry": float(entry),
@@ -119,75 +247,81 @@ def record_trade(symbol, signal, entry, tp1, tp2, sl):
             "tp2": float(tp2),
             "sl": float(sl),
             "timestamp": datetime.now().isoformat(),
+            "ts_epoch": int(time.time()),
             "status": "ACTIVE",
             "outcome": None,
             "pnl_percent": 0.0
         }
-        trade_history.append(t)
-        save_history()
+        # Assign id and append atomically so concurrent signals can't share an id
+        with stats_lock:
+            t = {"id": max((x['id'] for x in trade_history), default=0) + 1, **t}
+            trade_history.append(t)
+            STATS['total'] += 1
+        save_history([t])
     except Exception as e:
         print(f"❌ Record trade error: {e}")
 
+TRADE_STATUSES = (None, 'TP1_HIT', 'TP2_HIT', 'SL_HIT')
+
 def check_trades():
-    """Check active trades for TP/SL hits."""
+    """Check active trades for TP/SL hits (one fetch per symbol)."""
     global trade_history
-    updated = False
-    
+    updated = []
+    pending_msgs = []
+
+    groups = {}
     for trade in trade_history:
         if trade['status'] == 'ACTIVE':
-            try:
-                # Use entry timeframe for checking
-                df = fetch_data_safe(trade['symbol'], TIMEFRAME_ENTRY)
-                if df.empty: continue
-                
-                current_price = float(df.iloc[-1]['close'])
-                is_buy = "BUY" in trade['signal']
-                new_status = None
-                
-                # --- WIN/LOSS LOGIC (STRICT - NO PARTIALS) ---
-                if is_buy:
-                    if current_price >= trade['tp2']:
-                        new_status = 'TP2_HIT'; trade['outcome'] = 'WIN'
-                    elif current_price >= trade['tp1']:
-                        # TP1 is now a full WIN
-                        new_status = 'TP1_HIT'; trade['outcome'] = 'WIN'
-                    elif current_price <= trade['sl']:
-                        new_status = 'SL_HIT'; trade['outcome'] = 'LOSS'
-                else: # SELL
-                    if current_price <= trade['tp2']:
-                        new_status = 'TP2_HIT'; trade['outcome'] = 'WIN'
-                    elif current_price <= trade['tp1']:
-                        # TP1 is now a full WIN
-                        new_status = 'TP1_HIT'; trade['outcome'] = 'WIN'
-                    elif current_price >= trade['sl']:
-                        new_status = 'SL_HIT'; trade['outcome'] = 'LOSS'
-                
-                if new_status:
-                    trade['status'] = new_status
-                    # Calculate % gain/loss
-                    diff = (current_price - trade['entry']) / trade['entry'] * 100
-                    if not is_buy: diff = -diff
-                    trade['pnl_percent'] = diff
-                    
-                    msg = f"🔔 <b>UPDATE:</b> {trade['symbol']} hit {new_status} ({trade['outcome']})"
-                    asyncio.run(bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=msg, parse_mode='HTML'))
-                    updated = True
-                    
-                time.sleep(1) # Rate limit safety
-                
-            except Exception as e:
-                print(f"Check error {trade['symbol']}: {e}")
+            groups.setdefault(trade['symbol'], []).append(trade)
+
+    for symbol, grp in groups.items():
+        try:
+            # Use entry timeframe for checking
+            bars = fetch_data_safe(symbol, TIMEFRAME_ENTRY)
+            if bars is None: continue
+
+            current_price = float(bars.close[-1])
+            entry = np.array([t['entry'] for t in grp])
+            tp1 = np.array([t['tp1'] for t in grp])
+            tp2 = np.array([t['tp2'] for t in grp])
+            sl = np.array([t['sl'] for t in grp])
+            is_buy = np.array(["BUY" in t['signal'] for t in grp], dtype=bool)
+
+            # --- WIN/LOSS LOGIC (STRICT - NO PARTIALS) ---
+            # Codes index TRADE_STATUSES; TP1 is a full WIN, TP2 beats TP1 beats SL
+            codes = np.zeros(len(grp), dtype=np.int64)
+            eval_trades(current_price, entry, tp1, tp2, sl, is_buy, codes)
+
+            # Calculate % gain/loss
+            pnl = np.where(is_buy, 1.0, -1.0) * (current_price - entry) / entry * 100
+
+            for i in np.flatnonzero(codes):
+                trade = grp[i]
+                new_status = TRADE_STATUSES[codes[i]]
+                trade['status'] = new_status
+                trade['outcome'] = 'LOSS' if new_status == 'SL_HIT' else 'WIN'
+                trade['pnl_percent'] = float(pnl[i])
+                with stats_lock: STATS['wins' if trade['outcome'] == 'WIN' else 'losses'] += 1
+
+                pending_msgs.append(f"🔔 <b>UPDATE:</b> {trade['symbol']} hit {new_status} ({trade['outcome']})")
+                updated.append(trade)
+
+        except Exception as e:
+            print(f"Check error {symbol}: {e}")
     
-    if updated: save_history()
+    if updated: save_history(updated)
+    send_messages(pending_msgs)
 
 def daily_report():
     """Generate Win/Loss report."""
     try:
         check_trades() # Update first
+        compact_history()
         
-        now = datetime.now()
-        last_24h = now - timedelta(hours=24)
-        recent = [t for t in trade_history if datetime.fromisoformat(t['timestamp']) >= last_24h]
+        cutoff = int(time.time()) - 86400
+        # Older records lack ts_epoch; fall back to parsing the ISO timestamp
+        recent = [t for t in trade_history
+                  if (t['ts_epoch'] if 'ts_epoch' in t else datetime.fromisoformat(t['timestamp']).timestamp()) >= cutoff]
         
         if not recent:
             msg = "📊 <b>24H REPORT</b>\n\nNo trades in last 24h."
@@ -204,7 +338,7 @@ def daily_report():
                 f"Net PnL: {'🟢' if net_pct >= 0 else '🔴'} {net_pct:+.2f}%"
             )
             
-        asyncio.run(bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=msg, parse_mode='HTML'))
+        send_messages([msg])
     except Exception as e:
         print(f"Report error: {e}")
 
@@ -215,22 +349,25 @@ def daily_report():
 def generate_and_send_signal(symbol):
     global bot_stats
     try:
-        # 1. Fetch Multi-Timeframe Data
-        df_4h = fetch_data_safe(symbol, TIMEFRAME_MAIN)
-        df_1h = fetch_data_safe(symbol, TIMEFRAME_ENTRY)
-        
-        if not exchange.markets: exchange.load_markets()
-        market_id = exchange.market(symbol)['id']
-        ohlcv_d = exchange.fetch_ohlcv(market_id, '1d', limit=5)
-        df_d = pd.DataFrame(ohlcv_d, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        cpr = calculate_cpr_levels(df_d)
+        # 1. Fetch Multi-Timeframe Data (stop early unless the trends agree)
+        bars_4h = fetch_data_safe(symbol, TIMEFRAME_MAIN)
+        if bars_4h is None: return
+        trend_4h = "BULLISH" if bars_4h.sma9[-1] > bars_4h.sma20[-1] else "BEARISH"
+
+        bars_1h = fetch_data_safe(symbol, TIMEFRAME_ENTRY)
+        if bars_1h is None: return
+        trend_1h = "BULLISH" if bars_1h.sma9[-1] > bars_1h.sma20[-1] else "BEARISH"
+        if trend_4h != trend_1h: return
 
-        if df_4h.empty or df_1h.empty or cpr is None: return
+        ohlcv_d = fetch_ohlcv_cached(get_market_id(symbol), '1d', 5)
+        if len(ohlcv_d) < 2: return
+
+        # Previous daily candle: [timestamp, open, high, low, close, volume]
+        prev_day = ohlcv_d[-2]
+        cpr = calculate_cpr_levels(float(prev_day[2]), float(prev_day[3]), float(prev_day[4]))
 
         # 2. Extract Key Values
-        price = df_4h.iloc[-1]['close']
-        trend_4h = "BULLISH" if df_4h.iloc[-1]['sma9'] > df_4h.iloc[-1]['sma20'] else "BEARISH"
-        trend_1h = "BULLISH" if df_1h.iloc[-1]['sma9'] > df_1h.iloc[-1]['sma20'] else "BEARISH"
+        price = float(bars_4h.close[-1])
         
         # 3. Master Signal Logic
         signal = "WAIT (Neutral)"
@@ -274,15 +411,25 @@ def generate_and_send_signal(symbol):
             f"<i>Powered by Advanced CryptoBot</i>"
         )
 
-        asyncio.run(bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=message, parse_mode='HTML'))
+        send_messages([message])
         
-        bot_stats['total_analyses'] += 1
-        bot_stats['last_analysis'] = datetime.now().isoformat()
-        bot_stats['status'] = "operational"
+        with stats_lock:
+            bot_stats['total_analyses'] += 1
+            bot_stats['last_analysis'] = datetime.now().isoformat()
+            bot_stats['status'] = "operational"
 
     except Exception as e:
         print(f"❌ Analysis failed for {symbol}: {e}")
 
+def run_all_signals():
+    """Analyse every asset in a thread pool.
+
+    Exchange calls are serialized by exchange_lock (ccxt's rate limiter isn't
+    thread-safe), so only Telegram sends and local processing overlap.
+    """
+    with ThreadPoolExecutor(max_workers=min(8, len(CRYPTOS))) as ex:
+        list(ex.map(generate_and_send_signal, CRYPTOS))
+
 # =========================================================================
 # === SCHEDULER & FLASK ===
 # =========================================================================
@@ -290,13 +437,19 @@ def generate_and_send_signal(symbol):
 def start_bot():
     print(f"🚀 Initializing {bot_stats['version']}...")
     load_history()
+    init_markets()
+
+    # Warm up JIT kernels so the first real cycle doesn't pay compile time
+    _cpr_kernel(1.0, 1.0, 1.0)
+    eval_trades(1.0, np.ones(1), np.ones(1), np.ones(1), np.ones(1), np.ones(1, dtype=np.bool_), np.zeros(1, dtype=np.int64))
     
     scheduler = BackgroundScheduler()
     
     # --- ANALYSIS SCHEDULE (EVERY 2 HOURS) ---
-    for s in CRYPTOS:
-        # hour='*/2' = 00:00, 02:00, 04:00 ...
-        scheduler.add_job(generate_and_send_signal, 'cron', hour='*/2', minute='0', args=[s.strip()])
+    # One bulk job for all assets; hour='*/2' = 00:00, 02:00, 04:00 ...
+    # First run fires immediately so we don't wait 2 hours for the first signal
+    scheduler.add_job(run_all_signals, 'cron', hour='*/2', minute='0',
+                      id='run_all_signals', next_run_time=datetime.now())
     
     # Trade Checker (Every 15 mins to catch wins/losses quickly)
     scheduler.add_job(check_trades, 'cron', minute='15,30,45')
@@ -305,10 +458,6 @@ def start_bot():
     scheduler.add_job(daily_report, 'cron', hour='9', minute='0')
     
     scheduler.start()
-    
-    # Run initial analysis in thread so we don't wait 2 hours for first signal
-    for s in CRYPTOS:
-        threading.Thread(target=generate_and_send_signal, args=(s.strip(),)).start()
 
 start_bot()
 
@@ -316,9 +465,7 @@ app = Flask(__name__)
 
 @app.route('/')
 def home():
-    total = len(trade_history)
-    wins = len([t for t in trade_history if t.get('outcome') == 'WIN'])
-    losses = len([t for t in trade_history if t.get('outcome') == 'LOSS'])
+    total, wins, losses = STATS['total'], STATS['wins'], STATS['losses']
     wr = (wins / (wins + losses) * 100) if (wins + losses) > 0 else 0
     
     return render_template_string("""
@@ -343,5 +490,6 @@ def home():
 def health(): return jsonify({"status": "healthy"}), 200
 
 if __name__ == '__main__':
+    from waitress import serve
     port = int(os.environ.get("PORT", 10000))
-    app.run(host='0.0.0.0', port=port)
+    serve(app, host='0.0.0.0', port=port, threads=8)